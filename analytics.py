@@ -0,0 +1,190 @@
+# square-control, mobility and capture heatmaps over a corpus of games.
+# positions are streamed out of the games' replays into a fixed-size buffer. every time the buffer fills up, the
+# attacked squares and the mobility of every piece are computed for the whole buffer at once with NumPy and added
+# into fixed-size counters, so memory use doesn't depend on the size of the corpus. the corpus can be split across
+# processes, whose counters are summed at the end.
+#
+# unlike Board, which only considers Checks by pawns and horses, attacks and mobility are computed for every piece
+# type with the movement rules of the simulator (pawns move a single rubric forward).
+#
+# the counters, indexed [color, piece type, x, y] with color 0 for white and 1 for black and piece type the
+# PieceType value:
+#   attacked: the number of positions in which the rubric is attacked (or defended) by at least one such piece
+#   occupied: the number of positions in which such a piece stands on the rubric
+#   mobility: the total number of moves available to such pieces standing on the rubric (ignoring Check)
+#   captured: the number of times such a piece was captured on the rubric
+import argparse
+import csv
+import os
+from multiprocessing import Pool
+import numpy as np
+from corpus import list_game_ids, replay_positions
+from utils import DIAGONAL_DELTAS, HORSE_DELTAS, KING_DELTAS, PieceType, STRAIGHT_DELTAS
+
+BATCH_SIZE = 4096
+COLORS = ('WHITE', 'BLACK')
+PIECE_TYPES = [PieceType.PAWN, PieceType.BISHOP, PieceType.ROOK, PieceType.HORSE, PieceType.QUEEN, PieceType.KING]
+# piece codes, like Board.position_key: 0 is an empty rubric, 1-6 are white pieces and 7-12 black pieces
+BLACK_OFFSET = 7
+
+_SLIDER_DELTAS = {PieceType.BISHOP: DIAGONAL_DELTAS, PieceType.ROOK: STRAIGHT_DELTAS, PieceType.QUEEN: KING_DELTAS}
+
+
+def _shift(boards, dx, dy):
+    """returns boards where every rubric (x, y) holds the value of (x - dx, y - dy), and False off the board.
+    boards is a (batch, 8, 8) bool array indexed [position, x, y]"""
+    shifted = np.zeros_like(boards)
+    shifted[:, max(dx, 0):8 + min(dx, 0), max(dy, 0):8 + min(dy, 0)] = \
+        boards[:, max(-dx, 0):8 + min(-dx, 0), max(-dy, 0):8 + min(-dy, 0)]
+    return shifted
+
+
+class Heatmaps:
+    """the counters of a set of positions. two Heatmaps can be merged by adding them"""
+
+    def __init__(self):
+        shape = (len(COLORS), len(PIECE_TYPES), 8, 8)
+        self.positions = 0
+        self.attacked = np.zeros(shape, dtype=np.int64)
+        self.occupied = np.zeros(shape, dtype=np.int64)
+        self.mobility = np.zeros(shape, dtype=np.int64)
+        self.captured = np.zeros(shape, dtype=np.int64)
+
+    def __add__(self, other):
+        merged = Heatmaps()
+        merged.positions = self.positions + other.positions
+        for name in ('attacked', 'occupied', 'mobility', 'captured'):
+            setattr(merged, name, getattr(self, name) + getattr(other, name))
+        return merged
+
+    def add_batch(self, codes: np.ndarray, previous_codes: np.ndarray, has_previous: np.ndarray):
+        """adds a batch of positions. codes is a (batch, 64) array of piece codes, and previous_codes holds the
+        position before each of them (where has_previous is True), to find the captures"""
+        boards = codes.reshape(-1, 8, 8)
+        self.positions += len(boards)
+        occupied_by = [(boards > 0) & (boards < BLACK_OFFSET), boards >= BLACK_OFFSET]
+        empty = boards == 0
+
+        for color in range(len(COLORS)):
+            own, white = occupied_by[color], color == 0
+            for piece_type in PIECE_TYPES:
+                pieces = boards == piece_type.value + (1 if white else BLACK_OFFSET)
+                attacked, mobility = self._attacks_and_mobility(piece_type, pieces, white, own, empty)
+                self.attacked[color, piece_type.value] += attacked.sum(axis=0)
+                self.occupied[color, piece_type.value] += pieces.sum(axis=0)
+                self.mobility[color, piece_type.value] += np.where(pieces, mobility, 0).sum(axis=0)
+
+        # a rubric that holds different pieces before and after a move is where a capture happened
+        previous = previous_codes.reshape(-1, 8, 8)
+        captures = has_previous[:, None, None] & (previous > 0) & (boards > 0) & (previous != boards)
+        for color in range(len(COLORS)):
+            for piece_type in PIECE_TYPES:
+                captured = captures & (previous == piece_type.value + (1 if color == 0 else BLACK_OFFSET))
+                self.captured[color, piece_type.value] += captured.sum(axis=0)
+
+    @staticmethod
+    def _attacks_and_mobility(piece_type, pieces, white, own, empty):
+        """returns (rubrics attacked by any of the pieces, number of moves of a piece standing on each rubric)"""
+        attacked = np.zeros_like(pieces)
+        mobility = np.zeros(pieces.shape, dtype=np.int64)
+        if piece_type == PieceType.PAWN:
+            forward = 1 if white else -1
+            for dx in (-1, 1):
+                attacked |= _shift(pieces, dx, forward)
+                # at a pawn's rubric, whether the target rubric holds an opponent piece
+                enemy_at_target = _shift(~own & ~empty, -dx, -forward)
+                mobility += enemy_at_target
+            mobility += _shift(empty, 0, -forward)
+            return attacked, mobility
+
+        if piece_type in (PieceType.KING, PieceType.HORSE):
+            for dx, dy in (KING_DELTAS if piece_type == PieceType.KING else HORSE_DELTAS):
+                attacked |= _shift(pieces, dx, dy)
+                mobility += _shift(~own, -dx, -dy)
+            return attacked, mobility
+
+        for dx, dy in _SLIDER_DELTAS[piece_type]:
+            # reachable: at a piece's rubric, whether the ray is still open k rubrics away
+            reachable = np.ones_like(pieces)
+            for k in range(1, 8):
+                on_board = _shift(np.ones_like(pieces), -k * dx, -k * dy)
+                reachable &= on_board
+                if not reachable.any():
+                    break
+                attacked |= _shift(pieces & reachable, k * dx, k * dy)
+                mobility += reachable & _shift(~own, -k * dx, -k * dy)
+                reachable &= _shift(empty, -k * dx, -k * dy)
+        return attacked, mobility
+
+    def save(self, output_dir: str):
+        """writes the counters as .npy files and as a single csv file, one row per color, piece type and rubric"""
+        os.makedirs(output_dir, exist_ok=True)
+        np.save(os.path.join(output_dir, 'positions.npy'), np.array(self.positions))
+        for name in ('attacked', 'occupied', 'mobility', 'captured'):
+            np.save(os.path.join(output_dir, '%s.npy' % name), getattr(self, name))
+
+        with open(os.path.join(output_dir, 'heatmaps.csv'), 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['color', 'piece_type', 'x', 'y', 'positions', 'attacked', 'occupied', 'mobility',
+                             'captured'])
+            for color in range(len(COLORS)):
+                for piece_type in PIECE_TYPES:
+                    for x in range(8):
+                        for y in range(8):
+                            index = (color, piece_type.value, x, y)
+                            writer.writerow([COLORS[color], piece_type.name, x, y, self.positions,
+                                             self.attacked[index], self.occupied[index], self.mobility[index],
+                                             self.captured[index]])
+
+
+def collect_heatmaps(corpus_dir: str, game_ids, batch_size: int = BATCH_SIZE):
+    """replays the given games and returns the Heatmaps of all the positions they reach"""
+    heatmaps = Heatmaps()
+    codes = np.zeros((batch_size, 64), dtype=np.int8)
+    previous_codes = np.zeros((batch_size, 64), dtype=np.int8)
+    has_previous = np.zeros(batch_size, dtype=bool)
+    count = 0
+    for game_id in game_ids:
+        previous = None
+        for ply, board in replay_positions(os.path.join(corpus_dir, game_id)):
+            current = np.frombuffer(board.position_key(), dtype=np.int8, count=64)
+            codes[count] = current
+            has_previous[count] = previous is not None
+            if previous is not None:
+                previous_codes[count] = previous
+            previous = current
+            count += 1
+            if count == batch_size:
+                heatmaps.add_batch(codes, previous_codes, has_previous)
+                count = 0
+    if count:
+        heatmaps.add_batch(codes[:count], previous_codes[:count], has_previous[:count])
+    return heatmaps
+
+
+def _collect_shard(args):
+    return collect_heatmaps(*args)
+
+
+def collect_corpus_heatmaps(corpus_dir: str, processes: int = None, batch_size: int = BATCH_SIZE):
+    """collects the heatmaps of the whole corpus, splitting the games between processes"""
+    game_ids = list_game_ids(corpus_dir)
+    processes = processes or os.cpu_count()
+    shards = [(corpus_dir, game_ids[i::processes], batch_size) for i in range(processes)]
+    heatmaps = Heatmaps()
+    with Pool(processes) as pool:
+        for shard_heatmaps in pool.imap_unordered(_collect_shard, shards):
+            heatmaps = heatmaps + shard_heatmaps
+    return heatmaps
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='collect square-control, mobility and capture heatmaps')
+    parser.add_argument('corpus_dir', type=str)
+    parser.add_argument('output_dir', type=str)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    corpus_heatmaps = collect_corpus_heatmaps(args.corpus_dir, args.processes, args.batch_size)
+    corpus_heatmaps.save(args.output_dir)
+    print('collected %s positions' % corpus_heatmaps.positions)
@@ -0,0 +1,245 @@
+# lockstep simulation of many games at once.
+# the boards of N games are held in a single (N, 64) int8 array and every call to step() plays one ply in all the
+# ongoing games together: Check and Check-mate detection, move validation and captures are computed with NumPy
+# over the whole batch instead of one Board at a time. games that are over are masked out.
+#
+# the rules are the ones implemented by Board and Game.run, quirks included, so a batch replay reaches the same
+# results as running every game through Game.run:
+# * only the pieces named in Board.POTENTIAL_ATTACKERS (pawns and horses) give Check
+# * Check-mate only considers the king's moves
+# * the checkmated side still has to play a valid move, otherwise the game is borked
+# * bishops (and queens moving like bishops) follow the path computed by Bishop.is_valid_move
+import argparse
+import os
+import sys
+import numpy as np
+from board import Board
+from corpus import LAYOUT_FILENAME, list_game_ids, read_game_moves, run_game
+from game import Game
+from utils import HORSE_DELTAS, KING_DELTAS, PieceType, Position
+
+# piece codes: 0 is an empty rubric, 1-6 are white pieces and 7-12 black pieces (PieceType value + 1),
+# like Board.position_key. ATTACKER_FLAG is set on the pieces that can give Check
+WHITE_OFFSET = 1
+BLACK_OFFSET = 7
+ATTACKER_FLAG = 16
+CODE_MASK = 15
+
+
+def board_codes(board: Board):
+    """returns the (64,) int8 piece codes of the given board, square = x * 8 + y"""
+    codes = np.frombuffer(board.position_key()[:64], dtype=np.uint8).astype(np.int8)
+    for x in range(8):
+        for y in range(8):
+            if codes[x * 8 + y] and board.rubric(Position(x, y)).name in Board.POTENTIAL_ATTACKERS:
+                codes[x * 8 + y] |= ATTACKER_FLAG
+    return codes
+
+
+class BatchSimulator:
+    """N games played in lockstep. states holds the Game.State value of every game"""
+
+    def __init__(self, boards: np.ndarray, white_to_move: np.ndarray = None):
+        self.boards = np.array(boards, dtype=np.int8)
+        self.size = len(self.boards)
+        self._rows = np.arange(self.size)
+        self.white_to_move = np.ones(self.size, dtype=bool) if white_to_move is None \
+            else np.array(white_to_move, dtype=bool)
+        self.states = np.full(self.size, Game.State.ONGOING.value, dtype=np.int8)
+        self.plies = np.zeros(self.size, dtype=np.int32)
+
+    @classmethod
+    def from_layouts(cls, board_layout_filenames):
+        """creates a batch with one game per board layout file"""
+        boards = []
+        for board_layout_filename in board_layout_filenames:
+            board = Board()
+            board.set_pieces(board_layout_filename)
+            boards.append(board_codes(board))
+        return cls(np.array(boards, dtype=np.int8).reshape(len(boards), 64))
+
+    @property
+    def ongoing(self):
+        return self.states == Game.State.ONGOING.value
+
+    def _code_at(self, boards, x, y):
+        """returns the codes at the given coordinates, and 0 for coordinates off the board"""
+        on_board = (x >= 0) & (x < 8) & (y >= 0) & (y < 8)
+        squares = np.where(on_board, x * 8 + y, 0)
+        return np.where(on_board, boards[self._rows, squares], 0)
+
+    def _is_attacked(self, boards, squares, by_white):
+        """returns, for every board, whether the given square is attacked by the given color (vectorized
+        Board.get_attackers)"""
+        x, y = squares // 8, squares % 8
+        offset = np.where(by_white, WHITE_OFFSET, BLACK_OFFSET)
+        pawn = (PieceType.PAWN.value + offset) | ATTACKER_FLAG
+        horse = (PieceType.HORSE.value + offset) | ATTACKER_FLAG
+
+        # a white pawn attacks the rubrics diagonally in front of it, a black pawn the ones behind it
+        pawn_y = y - np.where(by_white, 1, -1)
+        attacked = (self._code_at(boards, x - 1, pawn_y) == pawn) | (self._code_at(boards, x + 1, pawn_y) == pawn)
+        for dx, dy in HORSE_DELTAS:
+            attacked |= self._code_at(boards, x + dx, y + dy) == horse
+        return attacked
+
+    def _king_squares(self, boards, white):
+        """returns the square of every board's king of the given color, and whether that king was found"""
+        king = PieceType.KING.value + np.where(white, WHITE_OFFSET, BLACK_OFFSET)
+        is_king = (boards & CODE_MASK) == king[:, None]
+        return is_king.argmax(axis=1), is_king.any(axis=1)
+
+    def detect_checkmate(self):
+        """returns (in check, checkmate) for the side to move of every game (vectorized Board.detect_checkmate)"""
+        boards, white = self.boards, self.white_to_move
+        king_squares, _ = self._king_squares(boards, white)
+        in_check = self._is_attacked(boards, king_squares, ~white)
+
+        # the king escapes if one of its next positions (on the board, not taken by its own side) isn't attacked
+        escapes = np.zeros(self.size, dtype=bool)
+        x, y = king_squares // 8, king_squares % 8
+        for dx, dy in KING_DELTAS:
+            on_board = (x + dx >= 0) & (x + dx < 8) & (y + dy >= 0) & (y + dy < 8)
+            target = self._code_at(boards, x + dx, y + dy) & CODE_MASK
+            own = (target > 0) & ((target < BLACK_OFFSET) == white)
+            candidate = on_board & ~own
+            escapes |= candidate & ~self._is_attacked(boards, np.where(candidate, (x + dx) * 8 + y + dy, 0), ~white)
+        return in_check, in_check & ~escapes
+
+    def _path_is_clear(self, boards, fx, fy, step_x, step_y, length):
+        """returns True where the length rubrics after (fx, fy) in the given direction are all empty"""
+        clear = np.ones(len(boards), dtype=bool)
+        for i in range(1, 8):
+            in_path = i <= length
+            clear &= ~in_path | (self._code_at(boards, fx + i * step_x, fy + i * step_y) == 0)
+        return clear
+
+    def _is_valid_pattern(self, boards, piece_types, white, fx, fy, tx, ty):
+        """vectorized is_valid_move of the moved pieces"""
+        dx, dy = tx - fx, ty - fy
+        step_x, step_y = np.sign(dx), np.sign(dy)
+        target_empty = self._code_at(boards, tx, ty) == 0
+
+        forward = np.where(white, 1, -1)
+        pawn = (dy == forward) & (((dx == 0) & target_empty) | ((np.abs(dx) == 1) & ~target_empty))
+
+        rook = ((dx == 0) | (dy == 0)) & \
+            self._path_is_clear(boards, fx, fy, step_x, step_y, np.maximum(np.abs(dx), np.abs(dy)) - 1)
+        # Bishop.is_valid_move checks the rubrics 1..abs(dx + 1) - 1 along the diagonal
+        bishop = (np.abs(dx) == np.abs(dy)) & \
+            self._path_is_clear(boards, fx, fy, step_x, step_y, np.abs(dx + 1) - 1)
+        horse = dx ** 2 + dy ** 2 == 5
+        king = (np.abs(dx) <= 1) & (np.abs(dy) <= 1)
+
+        return np.select([piece_types == PieceType.PAWN.value,
+                          piece_types == PieceType.ROOK.value,
+                          piece_types == PieceType.BISHOP.value,
+                          piece_types == PieceType.QUEEN.value,
+                          piece_types == PieceType.HORSE.value,
+                          piece_types == PieceType.KING.value],
+                         [pawn, rook, bishop, rook | bishop, horse, king], default=False)
+
+    def step(self, moves: np.ndarray, has_move: np.ndarray = None):
+        """plays one ply in every ongoing game, the way a single iteration of Game.run does.
+        moves is an (N, 4) int array of (from x, from y, to x, to y), and has_move is False for the
+        games whose player ran out of moves"""
+        moves = np.asarray(moves, dtype=np.int64)
+        has_move = np.ones(self.size, dtype=bool) if has_move is None else np.asarray(has_move, dtype=bool)
+        ongoing = self.ongoing
+        # a copy: white_to_move is updated below, but the winner is decided by the side that was to move
+        boards, white = self.boards, self.white_to_move.copy()
+        fx, fy, tx, ty = moves[:, 0], moves[:, 1], moves[:, 2], moves[:, 3]
+        from_squares, to_squares = fx * 8 + fy, tx * 8 + ty
+
+        # Board.get_king_attackers fails when the king was captured
+        _, has_king = self._king_squares(boards, white)
+        in_check, checkmate = self.detect_checkmate()
+
+        # the sanity checks of Board.move_piece
+        piece = boards[self._rows, from_squares]
+        moved_code = piece & CODE_MASK
+        piece_white = moved_code < BLACK_OFFSET
+        target_code = boards[self._rows, to_squares] & CODE_MASK
+        valid = has_king & has_move & (from_squares != to_squares) & (moved_code > 0) & (piece_white == white)
+        valid &= (target_code == 0) | ((target_code < BLACK_OFFSET) != white)
+        piece_types = (moved_code - np.where(piece_white, WHITE_OFFSET, BLACK_OFFSET)).astype(np.int64)
+        valid &= self._is_valid_pattern(boards, piece_types, white, fx, fy, tx, ty)
+
+        after = boards.copy()
+        after[self._rows, to_squares] = piece
+        after[self._rows, from_squares] = 0
+
+        # during Check, the move must resolve it
+        king_squares_after, _ = self._king_squares(after, white)
+        valid &= ~in_check | ~self._is_attacked(after, king_squares_after, ~white)
+
+        applied = ongoing & valid
+        self.boards[applied] = after[applied]
+        self.plies[applied] += 1
+        self.white_to_move[applied] = ~white[applied]
+
+        self.states[ongoing & ~valid] = Game.State.BORKED.value
+        # the checkmated side is the one that was to move before the ply
+        mated = applied & checkmate
+        self.states[mated & white] = Game.State.BLACK_WON.value
+        self.states[mated & ~white] = Game.State.WHITE_WON.value
+        return applied
+
+    def run(self, moves: np.ndarray, move_counts: np.ndarray):
+        """plays every game until its conclusion. moves is an (N, max plies, 4) array of the games' moves
+        in the order they are played and move_counts the number of moves of every game"""
+        ply = 0
+        while self.ongoing.any():
+            has_move = move_counts > ply
+            ply_moves = moves[:, ply] if ply < moves.shape[1] else np.zeros((self.size, 4), dtype=np.int64)
+            self.step(ply_moves, has_move)
+            ply += 1
+        return self.states
+
+
+def replay_corpus(corpus_dir: str):
+    """replays all the games of the corpus in lockstep. returns game id -> (Game.State, ply count)"""
+    game_ids = list_game_ids(corpus_dir)
+    if not game_ids:
+        return {}
+    game_dirs = [os.path.join(corpus_dir, game_id) for game_id in game_ids]
+    simulator = BatchSimulator.from_layouts([os.path.join(game_dir, LAYOUT_FILENAME) for game_dir in game_dirs])
+
+    game_moves = [read_game_moves(game_dir) for game_dir in game_dirs]
+    move_counts = np.array([len(moves) for moves in game_moves])
+    moves = np.zeros((len(game_ids), max(move_counts.max(), 1), 4), dtype=np.int64)
+    for i, game in enumerate(game_moves):
+        for ply, move in enumerate(game):
+            moves[i, ply] = (move.from_pos.x, move.from_pos.y, move.to_pos.x, move.to_pos.y)
+
+    states = simulator.run(moves, move_counts)
+    return {game_id: (Game.State(states[i]), int(simulator.plies[i])) for i, game_id in enumerate(game_ids)}
+
+
+def check_corpus(corpus_dir: str):
+    """replays the corpus in lockstep and runs every game through Game.run as well.
+    returns game id -> (batch (state, plies), Game.run (state, plies)) for the games whose results differ"""
+    mismatches = {}
+    for game_id, (state, plies) in replay_corpus(corpus_dir).items():
+        result = run_game(os.path.join(corpus_dir, game_id))
+        expected = (Game.State[result['state']], result['plies'])
+        if (state, plies) != expected:
+            mismatches[game_id] = ((state, plies), expected)
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='replay a corpus of games in lockstep')
+    parser.add_argument('corpus_dir', type=str)
+    parser.add_argument('--check', action='store_true',
+                        help='run every game through Game.run as well and fail if any result differs')
+    args = parser.parse_args()
+    if args.check:
+        corpus_mismatches = check_corpus(args.corpus_dir)
+        for game_id, ((state, plies), (expected_state, expected_plies)) in sorted(corpus_mismatches.items()):
+            print('%s: %s after %s plies, Game.run reached %s after %s plies' % (
+                game_id, state, plies, expected_state, expected_plies))
+        print('%s mismatches' % len(corpus_mismatches))
+        sys.exit(1 if corpus_mismatches else 0)
+    for game_id, (state, plies) in replay_corpus(args.corpus_dir).items():
+        print('%s: %s after %s plies' % (game_id, state, plies))
@@ -2,32 +2,55 @@
 from abstractPiece import AbstractPiece
 from concretePieces import Pawn, Rook, Horse, Bishop, Queen, King, PlaceHolder
 from utils import InternalErrorException, Position, PieceColor, PieceType, Move, InvalidMoveException
-import copy, json
+import copy, json, hashlib
+import tablebase
+from evaluation import DEFAULT_WEIGHTS, EvaluationWeights
 
 
 class Board:
+    # as allowed by the exercise, only pawns and horses are scanned for Checks
+    POTENTIAL_ATTACKERS = ['P0', 'P1', 'P2', 'P3', 'P4', 'P5', 'P6', 'P7', 'HL', 'HR']
+
     _rubrics = None
     _pieces = None  # dict that holds all active pieces, split by color. piece_name->piece
     _removed_pieces = None  # dict that holds all captured pieces, split by color. piece_name->piece
     _current_side_color = None
     _other_side_color = None
+    _evaluation_weights = None
+    # running evaluation terms, updated whenever a piece is placed, moved or removed
+    _middlegame_score = None  # color -> sum of the middlegame terms of its pieces
+    _endgame_score = None  # color -> sum of the endgame terms of its pieces
+    _phase = None  # sum of the phase weights of all the pieces
 
-    def __init__(self):
+    def __init__(self, evaluation_weights: EvaluationWeights = DEFAULT_WEIGHTS):
         self._rubrics = [[PlaceHolder(Position(y, x)) for x in range(8)] for y in range(8)]
         self._pieces = {PieceColor.WHITE: {}, PieceColor.BLACK: {}}
         self._removed_pieces = {PieceColor.WHITE: {}, PieceColor.BLACK: {}}
         self._current_side_color = PieceColor.WHITE
         self._other_side_color = PieceColor.BLACK
+        self._evaluation_weights = evaluation_weights
+        self._middlegame_score = {PieceColor.WHITE: 0, PieceColor.BLACK: 0}
+        self._endgame_score = {PieceColor.WHITE: 0, PieceColor.BLACK: 0}
+        self._phase = 0
 
     @property
     def current_player_color(self):
         return self._current_side_color
 
+    @property
+    def rubrics(self):
+        """the 8x8 grid of pieces, indexed [x][y], as the pieces' is_valid_move expects it. not to be modified"""
+        return self._rubrics
+
     def get_board_copy(self):
         """returns a copy of this board"""
-        board_copy = Board()
+        board_copy = Board(self._evaluation_weights)
         board_copy._current_side_color = self._current_side_color
         board_copy._other_side_color = self._other_side_color
+        board_copy._removed_pieces = {color: dict(pieces) for color, pieces in self._removed_pieces.items()}
+        board_copy._middlegame_score = dict(self._middlegame_score)
+        board_copy._endgame_score = dict(self._endgame_score)
+        board_copy._phase = self._phase
         board_copy._rubrics = copy.deepcopy(self._rubrics)
 
         # populate the dict with the copies of the objects:
@@ -39,6 +62,10 @@ class Board:
 
         return board_copy
 
+    def get_pieces(self, color: PieceColor):
+        """returns the list of the given side's pieces that are still on the board"""
+        return list(self._pieces[color].values())
+
     def switch_turns(self):
         self._current_side_color = PieceColor.BLACK if self._current_side_color == PieceColor.WHITE \
             else PieceColor.WHITE
@@ -53,15 +80,62 @@ class Board:
         self._rubrics[position.x][position.y] = piece
         piece.position = position
 
+    def _update_evaluation(self, piece: AbstractPiece, sign: int):
+        """adds (sign=1) or subtracts (sign=-1) the evaluation terms of the given piece at its current position"""
+        middlegame, endgame, phase = self._evaluation_weights.terms(piece.piece_type, piece.color,
+                                                                    piece.position.x, piece.position.y)
+        self._middlegame_score[piece.color] += sign * middlegame
+        self._endgame_score[piece.color] += sign * endgame
+        self._phase += sign * phase
+
+    def evaluate(self):
+        """returns the evaluation of the position for the current side, in centipawns.
+        the terms are kept up to date on every change to the board, so this doesnt scan the board"""
+        max_phase = self._evaluation_weights.max_phase
+        phase = min(self._phase, max_phase)
+        middlegame = self._middlegame_score[PieceColor.WHITE] - self._middlegame_score[PieceColor.BLACK]
+        endgame = self._endgame_score[PieceColor.WHITE] - self._endgame_score[PieceColor.BLACK]
+        score = (middlegame * phase + endgame * (max_phase - phase)) // max_phase
+        return score if self._current_side_color == PieceColor.WHITE else -score
+
+    def set_evaluation_weights(self, evaluation_weights: EvaluationWeights):
+        """replaces the evaluation weights, recomputing the evaluation terms from the pieces on the board"""
+        self._evaluation_weights = evaluation_weights
+        self._middlegame_score = {PieceColor.WHITE: 0, PieceColor.BLACK: 0}
+        self._endgame_score = {PieceColor.WHITE: 0, PieceColor.BLACK: 0}
+        self._phase = 0
+        for color in (PieceColor.WHITE, PieceColor.BLACK):
+            for piece in self._pieces[color].values():
+                self._update_evaluation(piece, 1)
+
+    def load_evaluation_weights(self, weights_filename: str):
+        """reads the evaluation weights from the given json file, see evaluation.py for its format"""
+        self.set_evaluation_weights(EvaluationWeights.load(weights_filename))
+
+    def position_key(self):
+        """returns a compact bytes representation of the position: one code per rubric plus the side to move"""
+        # code 0 is an empty rubric, 1-6 are white pieces and 7-12 are black pieces (PieceType value + 1)
+        key = bytearray(65)
+        for x in range(8):
+            for y in range(8):
+                piece = self._rubrics[x][y]
+                if piece.piece_type != PieceType.PLACEHOLDER:
+                    key[x * 8 + y] = piece.piece_type.value + (1 if piece.color == PieceColor.WHITE else 7)
+        key[64] = self._current_side_color.value
+        return bytes(key)
+
+    def position_hash(self):
+        """returns a 64 bit hash of the position, stable across processes and runs"""
+        return int.from_bytes(hashlib.blake2b(self.position_key(), digest_size=8).digest(), 'little')
+
     def get_attackers(self, attackers_color: PieceColor, attacked_position:Position):
         """return the list of pieces that are attacking the given position"""
 
         # scan all opposing pawns and horses on the board to see if any of them
         # is attacking the given position. Note: there may be multiple attackers
         # as allowed by the exercise, I'm not scanning for Checks by other pieces
-        potential_attackers = ['P0', 'P1', 'P2', 'P3', 'P4', 'P5', 'P6', 'P7', 'HL', 'HR']
         attackers = []
-        for attacker_name in potential_attackers:
+        for attacker_name in Board.POTENTIAL_ATTACKERS:
             attacker = self._pieces[attackers_color].get(attacker_name, None)
             if attacker and attacker.is_attacking(attacked_position):  # some pieces may be gone by now
                 attackers.append(attacker)
@@ -81,6 +155,7 @@ class Board:
         if piece.color not in (PieceColor.BLACK, PieceColor.WHITE):
             raise InternalErrorException("cant remove a piece with no color")
         x, y = piece.position.x, piece.position.y
+        self._update_evaluation(piece, -1)
         # set placeholder in its place
         self._rubrics[x][y] = PlaceHolder(piece.position)
 
@@ -146,7 +221,9 @@ class Board:
                 self.remove_piece(captured_piece)
 
             # move the piece to its destination
+            self._update_evaluation(piece, -1)
             self.set_rubric(piece, move.to_pos)
+            self._update_evaluation(piece, 1)
 
             # set empty placeholder in the origin rubric
             self.set_rubric(PlaceHolder(Position), move.from_pos)
@@ -183,6 +260,13 @@ class Board:
                 return False
         return True
 
+    def probe_tablebase(self, tablebase_dir: str):
+        """returns (TablebaseResult, distance to mate in plies) for the current side, or None if the pieces
+        on the board have no table in the given directory"""
+        pieces = [(piece.piece_type, color, piece.position.x, piece.position.y)
+                  for color in (PieceColor.WHITE, PieceColor.BLACK) for piece in self._pieces[color].values()]
+        return tablebase.probe(tablebase_dir, pieces, self._current_side_color)
+
     def set_pieces(self, board_layout_filename):
         """parse the given file into the state of the board"""
 
@@ -215,12 +299,14 @@ class Board:
             piece = get_instance(get_ctor(piece_type), PieceColor.WHITE, Position(x, y), name)
             white_pieces[name] = piece
             self._rubrics[x][y] = piece
+            self._update_evaluation(piece, 1)
 
         for piece_json in board_json['BLACK']:
             x, y, name, piece_type = int(piece_json['x']), int(piece_json['y']), piece_json['name'], piece_json['piece_type']
             piece = get_ctor(piece_type)(PieceColor.BLACK, Position(x, y), name)
             black_pieces[name] = piece
             self._rubrics[x][y] = piece
+            self._update_evaluation(piece, 1)
 
     def print(self):
         """Prints a crude representation of the game board"""
@@ -0,0 +1,237 @@
+# runs the games of a corpus on several worker processes, possibly on several hosts.
+# the coordinator splits the corpus into shards of game ids and hands them to the workers that connect to it over
+# TCP. workers run each game through Game.run and stream the results back one game at a time, sending heartbeats
+# while they work. a worker that disconnects or stops sending heartbeats is dropped and the games of its shard that
+# have no result yet go back to the queue for the other workers. once every game has a result, the coordinator
+# writes all of them into a single json file and tells the workers to exit.
+#
+# messages are json objects, one per line:
+#   worker -> coordinator: {"type": "hello", "worker": name}, {"type": "heartbeat"},
+#                          {"type": "result", "game_id": ..., "result": {...}}
+#   coordinator -> worker: {"type": "shard", "game_ids": [...]}, {"type": "done"}
+#
+# every worker needs access to the corpus (the same directory, or a copy of it) - only game ids are sent.
+# workers can share a result cache (see resultCache.py), so only new or changed games are replayed
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import subprocess
+import sys
+import threading
+from corpus import list_game_ids, run_game, write_results
+from resultCache import ResultCache
+
+logger = logging.getLogger()
+
+HEARTBEAT_INTERVAL = 1.0  # seconds between heartbeats sent by a worker
+HEARTBEAT_TIMEOUT = 10.0  # seconds without any message after which a busy worker is considered gone
+DEFAULT_SHARD_SIZE = 16
+
+
+def send_message(writer, lock: threading.Lock, message: dict):
+    with lock:
+        writer.write(json.dumps(message) + '\n')
+        writer.flush()
+
+
+def read_message(reader):
+    """returns the next message, or None if the other side closed the connection"""
+    line = reader.readline()
+    return json.loads(line) if line else None
+
+
+class Coordinator:
+    """hands out shards of a corpus to the connected workers and collects their results"""
+
+    class WorkersLostException(Exception):
+        """for when no worker is left to run the games that have no result yet"""
+        pass
+
+    _game_ids = None
+    _pending_shards = None  # queue of lists of game ids
+    _results = None  # game id -> result
+    _results_lock = None
+    _all_done = None
+    _server = None
+
+    def __init__(self, corpus_dir: str, shard_size: int = DEFAULT_SHARD_SIZE, host: str = '127.0.0.1',
+                 port: int = 0):
+        self._game_ids = list_game_ids(corpus_dir)
+        self._pending_shards = queue.Queue()
+        for i in range(0, len(self._game_ids), shard_size):
+            self._pending_shards.put(self._game_ids[i:i + shard_size])
+        self._results = {}
+        self._results_lock = threading.Lock()
+        self._all_done = threading.Event()
+        if not self._game_ids:
+            self._all_done.set()
+        self._server = socket.create_server((host, port))
+
+    @property
+    def address(self):
+        """the (host, port) workers should connect to"""
+        return self._server.getsockname()[:2]
+
+    def serve(self, workers_alive=None):
+        """accepts workers until every game has a result. returns game id -> result.
+        workers_alive, when given, is called while waiting and returns False once no worker can connect or send
+        results anymore; serve then raises WorkersLostException instead of waiting forever"""
+        self._server.settimeout(HEARTBEAT_INTERVAL)
+        handlers = []
+        try:
+            while not self._all_done.is_set():
+                try:
+                    connection, address = self._server.accept()
+                except socket.timeout:
+                    # give the handlers a moment to record the results the last workers sent before exiting
+                    if workers_alive is not None and not workers_alive() \
+                            and not self._all_done.wait(HEARTBEAT_INTERVAL):
+                        raise Coordinator.WorkersLostException(
+                            'all workers exited, no result for games: %s' % ', '.join(self.missing_game_ids()))
+                    continue
+                handler = threading.Thread(target=self._handle_worker, args=(connection, address), daemon=True)
+                handler.start()
+                handlers.append(handler)
+        finally:
+            self._server.close()
+        for handler in handlers:
+            handler.join()
+        return dict(self._results)
+
+    def missing_game_ids(self):
+        """returns the ids of the games that have no result yet"""
+        with self._results_lock:
+            return [game_id for game_id in self._game_ids if game_id not in self._results]
+
+    def _record_result(self, game_id: str, result: dict):
+        with self._results_lock:
+            self._results[game_id] = result
+            if len(self._results) == len(self._game_ids):
+                self._all_done.set()
+
+    def _handle_worker(self, connection: socket.socket, address):
+        """feeds shards to a single worker until all games are done or the worker is gone"""
+        connection.settimeout(HEARTBEAT_TIMEOUT)
+        reader, writer = connection.makefile('r'), connection.makefile('w')
+        write_lock = threading.Lock()
+        remaining = []  # the games of the current shard that have no result yet
+        try:
+            hello = read_message(reader)
+            worker_name = hello['worker'] if hello else address
+            logger.info('worker %s connected', worker_name)
+            while not self._all_done.is_set():
+                if not remaining:
+                    try:
+                        remaining = self._pending_shards.get(timeout=HEARTBEAT_INTERVAL)
+                    except queue.Empty:
+                        continue
+                    send_message(writer, write_lock, {'type': 'shard', 'game_ids': remaining})
+
+                # every message from the worker, heartbeats included, proves it is alive
+                message = read_message(reader)
+                if message is None:
+                    raise ConnectionError('worker %s disconnected' % worker_name)
+                if message['type'] == 'result':
+                    self._record_result(message['game_id'], message['result'])
+                    if message['game_id'] in remaining:
+                        remaining.remove(message['game_id'])
+            send_message(writer, write_lock, {'type': 'done'})
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning('lost worker at %s: %s', address, e)
+        finally:
+            if remaining:
+                # give the unfinished games to another worker
+                self._pending_shards.put(remaining)
+            connection.close()
+
+
+def run_worker(host: str, port: int, corpus_dir: str, name: str = None, cache_filename: str = None):
+    """connects to the coordinator and runs the shards it hands out until it says it's done"""
+    cache = ResultCache(cache_filename) if cache_filename else None
+    connection = socket.create_connection((host, port))
+    reader, writer = connection.makefile('r'), connection.makefile('w')
+    write_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def send_heartbeats():
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                send_message(writer, write_lock, {'type': 'heartbeat'})
+            except OSError:
+                return
+
+    send_message(writer, write_lock, {'type': 'hello', 'worker': name or '%s:%s' % (socket.gethostname(),
+                                                                                    os.getpid())})
+    heartbeats = threading.Thread(target=send_heartbeats, daemon=True)
+    heartbeats.start()
+    try:
+        while True:
+            message = read_message(reader)
+            if message is None or message['type'] == 'done':
+                break
+            if message['type'] == 'shard':
+                for game_id in message['game_ids']:
+                    game_dir = os.path.join(corpus_dir, game_id)
+                    result = cache.run_game(game_dir) if cache else run_game(game_dir)
+                    send_message(writer, write_lock, {'type': 'result', 'game_id': game_id, 'result': result})
+    finally:
+        stopped.set()
+        connection.close()
+        if cache:
+            cache.evict()
+            cache.close()
+
+
+def run_local(corpus_dir: str, output_filename: str, worker_count: int, shard_size: int = DEFAULT_SHARD_SIZE,
+              cache_filename: str = None):
+    """runs a coordinator and the given number of worker processes on this host"""
+    coordinator = Coordinator(corpus_dir, shard_size)
+    host, port = coordinator.address
+    worker_args = [sys.executable, os.path.abspath(__file__), 'worker', host, str(port), corpus_dir]
+    if cache_filename:
+        worker_args += ['--cache-file', cache_filename]
+    workers = [subprocess.Popen(worker_args) for _ in range(worker_count)]
+    try:
+        results = coordinator.serve(lambda: any(worker.poll() is None for worker in workers))
+    finally:
+        for worker in workers:
+            if worker.wait() != 0:
+                logger.warning('worker process %s exited with code %s', worker.pid, worker.returncode)
+    write_results(results, output_filename)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='run the games of a corpus on several workers')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    coordinator_parser = subparsers.add_parser('coordinator', help='hand out the corpus to workers')
+    coordinator_parser.add_argument('corpus_dir', type=str)
+    coordinator_parser.add_argument('output_file', type=str)
+    coordinator_parser.add_argument('--host', type=str, default='0.0.0.0')
+    coordinator_parser.add_argument('--port', type=int, default=0)
+    coordinator_parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    worker_parser = subparsers.add_parser('worker', help='run the games handed out by a coordinator')
+    worker_parser.add_argument('host', type=str)
+    worker_parser.add_argument('port', type=int)
+    worker_parser.add_argument('corpus_dir', type=str)
+    worker_parser.add_argument('--cache-file', type=str, default=None, help='a result cache shared by the workers')
+    local_parser = subparsers.add_parser('local', help='run a coordinator and workers on this host')
+    local_parser.add_argument('corpus_dir', type=str)
+    local_parser.add_argument('output_file', type=str)
+    local_parser.add_argument('--workers', type=int, default=os.cpu_count())
+    local_parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    local_parser.add_argument('--cache-file', type=str, default=None, help='a result cache shared by the workers')
+    args = parser.parse_args()
+
+    if args.command == 'coordinator':
+        coordinator = Coordinator(args.corpus_dir, args.shard_size, args.host, args.port)
+        print('waiting for workers on port %s' % coordinator.address[1])
+        write_results(coordinator.serve(), args.output_file)
+    elif args.command == 'worker':
+        run_worker(args.host, args.port, args.corpus_dir, cache_filename=args.cache_file)
+    else:
+        results = run_local(args.corpus_dir, args.output_file, args.workers, args.shard_size, args.cache_file)
+        print('ran %s games' % len(results))
@@ -0,0 +1,119 @@
+# helpers for working with a corpus of recorded games.
+# a corpus is a directory tree in which every game is a directory holding the board layout and
+# both players' moves, in the same format used by game_samples/
+import contextlib
+import io
+import json
+import os
+from board import Board
+from game import Game, NO_INPUT_FAILURE_REASON
+from player import Player
+from utils import Move, PieceColor
+
+LAYOUT_FILENAME = 'initial_board_layout.json'
+P1_MOVES_FILENAME = 'p1_moves.txt'
+P2_MOVES_FILENAME = 'p2_moves.txt'
+
+
+def quiet():
+    """returns a context manager that discards everything printed inside it. Board and Game print while they
+    validate moves and run, which only slows down the replay of a corpus"""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def is_game_dir(path: str):
+    """returns True if the given directory holds a recorded game"""
+    return all(os.path.isfile(os.path.join(path, filename))
+               for filename in (LAYOUT_FILENAME, P1_MOVES_FILENAME, P2_MOVES_FILENAME))
+
+
+def list_game_ids(corpus_dir: str):
+    """returns the sorted list of game ids (game directories, relative to the corpus dir) in the corpus"""
+    game_ids = []
+    for dir_path, dir_names, _ in os.walk(corpus_dir):
+        dir_names.sort()
+        if is_game_dir(dir_path):
+            game_ids.append(os.path.relpath(dir_path, corpus_dir))
+    return sorted(game_ids)
+
+
+def read_game_moves(game_dir: str):
+    """returns the moves of the game in the order they are played: player1 (white), player2, player1..."""
+    with open(os.path.join(game_dir, P1_MOVES_FILENAME)) as p1_file:
+        p1_moves = Player.read_moves(p1_file)
+    with open(os.path.join(game_dir, P2_MOVES_FILENAME)) as p2_file:
+        p2_moves = Player.read_moves(p2_file)
+
+    # the game stops as soon as the player to move runs out of moves
+    moves = []
+    for ply in range(len(p1_moves) + len(p2_moves)):
+        player_moves = p1_moves if ply % 2 == 0 else p2_moves
+        if ply // 2 >= len(player_moves):
+            break
+        moves.append(player_moves[ply // 2])
+    return moves
+
+
+def play_ply(board: Board, move: Move, checkmate: bool):
+    """applies a move and passes the turn, the way Game.run does. checkmate tells whether the side playing the
+    move was in Check-mate before it: that side still has to play a valid move, and the game ends right after it.
+    returns the winning Game.State if the game is over, None otherwise"""
+    board.move_piece(move)
+    board.switch_turns()
+    if not checkmate:
+        return None
+    return Game.State.WHITE_WON if board.current_player_color == PieceColor.WHITE else Game.State.BLACK_WON
+
+
+def play_moves(board: Board, moves):
+    """plays the given moves on the board following the same loop as Game.run: detect Check-mate, play the next
+    move, switch sides. yields (ply, board) after every move played. moves may be a generator, it is only asked
+    for a move once the previous one is on the board.
+    the generator returns the result Game.run reaches, in the format of run_game"""
+    moves = iter(moves)
+    ply = 0
+    try:
+        while True:
+            checkmate = board.detect_checkmate()
+            move = next(moves, None)
+            if move is None:
+                # the player to move has no more moves to give
+                return {'state': Game.State.BORKED.name, 'plies': ply, 'failure_reason': NO_INPUT_FAILURE_REASON}
+            with quiet():
+                winner = play_ply(board, move, checkmate)
+            ply += 1
+            yield ply, board
+            if winner is not None:
+                return {'state': winner.name, 'plies': ply, 'failure_reason': None}
+    except Exception as e:  # like in Game.run, anything that goes wrong borks the game
+        return {'state': Game.State.BORKED.name, 'plies': ply, 'failure_reason': str(e)}
+
+
+def replay_positions(game_dir: str):
+    """replays the given game, yielding (ply, board) for every position reached, starting at the initial layout.
+    the replay ends where Game.run ends: at the first invalid move, or right after the mating move. the same board
+    object is yielded every time, so callers that want to keep a position must copy it"""
+    board = Board()
+    board.set_pieces(os.path.join(game_dir, LAYOUT_FILENAME))
+    yield 0, board
+    yield from play_moves(board, read_game_moves(game_dir))
+
+
+def run_game(game_dir: str, tablebase_dir: str = None):
+    """runs the given game through Game.run, discarding its output.
+    returns a dict with the final state's name, the number of plies played and the failure reason"""
+    with quiet():
+        try:
+            player1 = Player("Player1", os.path.join(game_dir, P1_MOVES_FILENAME))
+            player2 = Player("Player2", os.path.join(game_dir, P2_MOVES_FILENAME))
+            game = Game(os.path.join(game_dir, LAYOUT_FILENAME), player1, player2, tablebase_dir)
+        except Exception as e:  # unreadable game files
+            return {'state': Game.State.BORKED.name, 'plies': 0, 'failure_reason': str(e)}
+        state = game.run()
+    return {'state': state.name, 'plies': game.ply_count, 'failure_reason': game.failure_reason}
+
+
+def write_results(results: dict, output_filename: str):
+    """writes the results of games (game id -> run_game result) into a json file, ordered by game id"""
+    with open(output_filename, 'w') as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
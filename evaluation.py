@@ -0,0 +1,105 @@
+# weights for the evaluation kept by Board: material and piece-square terms, for both the middlegame and the
+# endgame. Board.evaluate blends the two by the game phase, which shrinks as pieces are captured.
+#
+# weights can be loaded from a json file of this form (every key is optional and defaults to the built-in weights):
+#   {"max_phase": 24,
+#    "pieces": {"PAWN": {"value": [82, 94], "phase": 0,
+#                        "middlegame": [[8 values], ... 8 rows], "endgame": [[8 values], ... 8 rows]},
+#               ...}}
+# "value" is the (middlegame, endgame) material value. the piece-square tables are written from white's point of view
+# and laid out like Board.print: the first row is y=7 and the values in a row go from x=0 to x=7.
+# black pieces use the same tables, mirrored.
+import json
+from utils import PieceColor, PieceType
+
+MAX_PHASE = 24
+
+# middlegame and endgame material values
+_DEFAULT_VALUES = {PieceType.PAWN: (82, 94), PieceType.HORSE: (337, 281), PieceType.BISHOP: (365, 297),
+                   PieceType.ROOK: (477, 512), PieceType.QUEEN: (1025, 936), PieceType.KING: (0, 0)}
+# how much each piece counts towards the middlegame. the initial layout adds up to MAX_PHASE
+_DEFAULT_PHASES = {PieceType.PAWN: 0, PieceType.HORSE: 1, PieceType.BISHOP: 1, PieceType.ROOK: 2,
+                   PieceType.QUEEN: 4, PieceType.KING: 0}
+
+
+def _center_distance(x, y):
+    """0 for the four center rubrics, up to 6 for the corners"""
+    return int(abs(x - 3.5) + abs(y - 3.5) - 1)
+
+
+def _default_table(piece_type: PieceType, endgame: bool):
+    """returns the built-in piece-square table of the given piece as [x][y], from white's point of view"""
+    def term(x, y):
+        if piece_type == PieceType.PAWN:
+            return (10 if endgame else 5) * max(y - 1, 0)  # pawns are worth more as they advance
+        if piece_type == PieceType.KING:
+            # the king hides on its first rank in the middlegame and comes to the center in the endgame
+            return -5 * _center_distance(x, y) if endgame else -10 * y + 5 * int(abs(x - 3.5))
+        if piece_type == PieceType.ROOK:
+            return 10 if y == 6 else 0  # rooks like the 7th rank
+        # minor pieces and the queen like the center
+        return -(5 if piece_type == PieceType.HORSE else 3) * _center_distance(x, y)
+    return [[term(x, y) for y in range(8)] for x in range(8)]
+
+
+class EvaluationWeights:
+    """material and piece-square weights used by Board.evaluate"""
+
+    _terms = None  # color -> piece type -> [x][y] -> (middlegame, endgame)
+    _phases = None  # piece type -> phase weight
+    _max_phase = None
+
+    def __init__(self, values=None, phases=None, middlegame_tables=None, endgame_tables=None, max_phase=MAX_PHASE):
+        """tables are [x][y] from white's point of view. missing items default to the built-in weights"""
+        values = {**_DEFAULT_VALUES, **(values or {})}
+        self._phases = {**_DEFAULT_PHASES, **(phases or {})}
+        self._max_phase = max_phase
+        middlegame_tables = middlegame_tables or {}
+        endgame_tables = endgame_tables or {}
+
+        self._terms = {PieceColor.WHITE: {}, PieceColor.BLACK: {}}
+        for piece_type in _DEFAULT_VALUES:
+            middlegame = middlegame_tables.get(piece_type) or _default_table(piece_type, endgame=False)
+            endgame = endgame_tables.get(piece_type) or _default_table(piece_type, endgame=True)
+            middlegame_value, endgame_value = values[piece_type]
+            white_terms = [[(middlegame_value + middlegame[x][y], endgame_value + endgame[x][y])
+                            for y in range(8)] for x in range(8)]
+            self._terms[PieceColor.WHITE][piece_type] = white_terms
+            # black's tables are mirrored: its first rank is y=7
+            self._terms[PieceColor.BLACK][piece_type] = [list(reversed(column)) for column in white_terms]
+
+    @property
+    def max_phase(self):
+        return self._max_phase
+
+    def terms(self, piece_type: PieceType, color: PieceColor, x: int, y: int):
+        """returns the (middlegame, endgame, phase) contribution of a piece on the given rubric"""
+        middlegame, endgame = self._terms[color][piece_type][x][y]
+        return middlegame, endgame, self._phases[piece_type]
+
+    @staticmethod
+    def load(filename: str):
+        """reads weights from a json file, see the top of this file for the format"""
+        weights_json = json.loads(open(filename).read())
+        values, phases, middlegame_tables, endgame_tables = {}, {}, {}, {}
+
+        def to_table(rows):
+            # rows are written like Board.print (first row is y=7), tables are [x][y]
+            return [[rows[7 - y][x] for y in range(8)] for x in range(8)]
+
+        for piece_type_str, piece_json in weights_json.get('pieces', {}).items():
+            piece_type = PieceType[piece_type_str]
+            if 'value' in piece_json:
+                values[piece_type] = tuple(piece_json['value'])
+            if 'phase' in piece_json:
+                phases[piece_type] = piece_json['phase']
+            if 'middlegame' in piece_json:
+                middlegame_tables[piece_type] = to_table(piece_json['middlegame'])
+            if 'endgame' in piece_json:
+                endgame_tables[piece_type] = to_table(piece_json['endgame'])
+
+        return EvaluationWeights(values, phases, middlegame_tables, endgame_tables,
+                                 weights_json.get('max_phase', MAX_PHASE))
+
+
+DEFAULT_WEIGHTS = EvaluationWeights()
@@ -2,6 +2,7 @@
 # it holds the players and the board entities
 from board import Board
 from utils import Position, Move, PieceColor, call_timeout
+from tablebase import TablebaseResult
 import logging
 from enum import Enum
 from player import Player
@@ -9,6 +10,8 @@ import argparse
 
 logger = logging.getLogger()
 
+NO_INPUT_FAILURE_REASON = "no valid input from player"
+
 
 def get_next_move(f):
     """Get the next move from the player"""
@@ -17,7 +20,7 @@ def get_next_move(f):
     try:
         return call_timeout(Game.MAX_SECONDS_TO_WAIT_FOR_PLAYER_INPUT, f)
     except Exception:
-        raise Game.InvalidGameInputException("no valid input from player")
+        raise Game.InvalidGameInputException(NO_INPUT_FAILURE_REASON)
 
 
 class Game:
@@ -32,14 +35,18 @@ class Game:
     _playerTwo = None
     _board = None
     _game_state = None
+    _tablebase_dir = None
+    _ply_count = 0
+    _failure_reason = None
 
     class State(Enum):
         ONGOING = 1
         BLACK_WON = 2
         WHITE_WON = 3
         BORKED = 4
+        DRAW = 5
 
-    def __init__(self, board_layout_filename: str, player1: Player, player2: Player):
+    def __init__(self, board_layout_filename: str, player1: Player, player2: Player, tablebase_dir: str = None):
         self._board = Board()
         logger.info('resetting pieces on the board')
         self._board.set_pieces(board_layout_filename)
@@ -47,11 +54,22 @@ class Game:
         self._playerOne = player1
         self._playerTwo = player2
         self._current_player = player1 # player 1 is WHITE
+        self._tablebase_dir = tablebase_dir  # when set, games that reach a tablebase ending are adjudicated
 
     @property
     def game_state(self):
         return self._game_state
 
+    @property
+    def ply_count(self):
+        """the number of moves applied to the board so far"""
+        return self._ply_count
+
+    @property
+    def failure_reason(self):
+        """why the game got borked, if it did"""
+        return self._failure_reason
+
     @property
     def current_player(self):
         return self._current_player
@@ -59,6 +77,24 @@ class Game:
     def switch_players(self):
         self._current_player = self._playerTwo if self._current_player == self._playerOne else self._playerOne
 
+    def adjudicate(self):
+        """ends the game with the tablebase result if the board reached a tablebase ending.
+        returns True if the game was adjudicated.
+        the tables follow standard chess rules (see tablebase.py), so the adjudicated result is the ending's result
+        under standard chess. it may differ from playing the game out, where only pawns and horses give Check"""
+        probe_result = self._board.probe_tablebase(self._tablebase_dir)
+        if probe_result is None:
+            return False
+
+        result, _ = probe_result
+        if result == TablebaseResult.DRAW:
+            self._game_state = Game.State.DRAW
+        elif (result == TablebaseResult.WIN) == (self._board.current_player_color == PieceColor.WHITE):
+            self._game_state = Game.State.WHITE_WON
+        else:
+            self._game_state = Game.State.BLACK_WON
+        return True
+
     def run(self):
         """runs the game until its conclusion or exception"""
         try:
@@ -71,10 +107,15 @@ class Game:
                     else:
                         self._game_state = Game.State.WHITE_WON
 
+                # a Check-mate found above decides the game. only an undecided game goes to the tablebase
+                if self.game_state == Game.State.ONGOING and self._tablebase_dir and self.adjudicate():
+                    break
+
                 # get the next move from the current player:
                 move = get_next_move(self.current_player.next_move)
                 # apply the move onto the board
                 self._board.move_piece(move)
+                self._ply_count += 1
                 self._board.print()
 
                 # switch sides
@@ -84,16 +125,18 @@ class Game:
 
         except Exception as e:
             print(e)
+            self._failure_reason = str(e)
             self._game_state = Game.State.BORKED
 
         return self._game_state
 
 
-def start_game(board_layout_filename: str, player1_moves_filename: str, player2_moves_filename: str):
+def start_game(board_layout_filename: str, player1_moves_filename: str, player2_moves_filename: str,
+               tablebase_dir: str = None):
     print('starting game...')
     p1 = Player("Player1", player1_moves_filename)
     p2 = Player("Player2", player2_moves_filename)
-    game = Game(board_layout_filename, p1, p2)
+    game = Game(board_layout_filename, p1, p2, tablebase_dir)
 
     print("game result: %s" % game.run())
 
@@ -103,5 +146,8 @@ if __name__ == "__main__":
     parser.add_argument('player1_moves_file', type=str)
     parser.add_argument('player2_moves_file', type=str)
     parser.add_argument('board_layout', type=str)
+    parser.add_argument('--tablebase-dir', type=str, default=None,
+                        help='adjudicate the game once it reaches an ending found in this directory. the result is '
+                             'the one under standard chess rules, which may differ from playing the game out')
     args = parser.parse_args()
-    start_game(args.board_layout, args.player1_moves_file, args.player2_moves_file)
+    start_game(args.board_layout, args.player1_moves_file, args.player2_moves_file, args.tablebase_dir)
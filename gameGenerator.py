@@ -0,0 +1,181 @@
+# generates random games for load and fuzz testing.
+# every game starts from the given layout and is played by picking random moves that Board.move_piece accepts,
+# following the same loop as Game.run: detect Check-mate, play a move, switch sides. the generator knows how the
+# game must end, so replaying it through Game.run and comparing the results doubles as a fuzzer for Board and Game.
+#
+# games are deterministic: game number i of a given seed is always the same, whichever process generates it.
+# each game is written as a game directory (see corpus.py) along with a compact copy of its moves: two bytes per
+# ply, in the order they are played, holding from_square * 64 + to_square with square = x * 8 + y.
+import argparse
+import os
+import random
+import shutil
+import struct
+from multiprocessing import Pool
+from board import Board
+from corpus import LAYOUT_FILENAME, P1_MOVES_FILENAME, P2_MOVES_FILENAME, play_moves, quiet, run_game
+from utils import DIAGONAL_DELTAS, HORSE_DELTAS, KING_DELTAS, Move, PieceColor, PieceType, Position, \
+    STRAIGHT_DELTAS
+
+COMPACT_MOVES_FILENAME = 'moves.bin'
+DEFAULT_MAX_PLIES = 200
+# with a capture weight w, a move that captures a piece of value v is (1 + w * v) times as likely as a quiet move
+CAPTURE_VALUES = {PieceType.PAWN: 1, PieceType.HORSE: 3, PieceType.BISHOP: 3, PieceType.ROOK: 5,
+                  PieceType.QUEEN: 9, PieceType.KING: 0}
+
+
+def write_compact_moves(filename: str, moves):
+    with open(filename, 'wb') as moves_file:
+        for move in moves:
+            from_square = move.from_pos.x * 8 + move.from_pos.y
+            to_square = move.to_pos.x * 8 + move.to_pos.y
+            moves_file.write(struct.pack('<H', from_square * 64 + to_square))
+
+
+def read_compact_moves(filename: str):
+    """returns the moves of a compact moves file, in the order they are played"""
+    with open(filename, 'rb') as moves_file:
+        contents = moves_file.read()
+    moves = []
+    for (packed,) in struct.iter_unpack('<H', contents):
+        from_square, to_square = divmod(packed, 64)
+        moves.append(Move(Position(from_square // 8, from_square % 8), Position(to_square // 8, to_square % 8)))
+    return moves
+
+
+def _candidate_destinations(piece):
+    """returns the rubrics the given piece might move to, judging by its movement pattern alone.
+    this is a superset of its valid moves: Board.move_piece has the final say"""
+    x, y = piece.position.x, piece.position.y
+    if piece.piece_type == PieceType.PAWN:
+        forward = 1 if piece.color == PieceColor.WHITE else -1
+        deltas = [(0, forward), (1, forward), (-1, forward)]
+    elif piece.piece_type == PieceType.HORSE:
+        deltas = HORSE_DELTAS
+    elif piece.piece_type == PieceType.KING:
+        deltas = KING_DELTAS
+    else:
+        directions = {PieceType.ROOK: STRAIGHT_DELTAS, PieceType.BISHOP: DIAGONAL_DELTAS,
+                      PieceType.QUEEN: STRAIGHT_DELTAS + DIAGONAL_DELTAS}[piece.piece_type]
+        deltas = [(dx * distance, dy * distance) for dx, dy in directions for distance in range(1, 8)]
+    return [(x + dx, y + dy) for dx, dy in deltas if 0 <= x + dx < 8 and 0 <= y + dy < 8]
+
+
+def pick_move(board: Board, rnd: random.Random, capture_weight: float = 0.0):
+    """picks a random move that Board.move_piece accepts, or returns None if there is no such move.
+    moves are weighted by what they capture, see CAPTURE_VALUES"""
+    candidates = []
+    for piece in board.get_pieces(board.current_player_color):
+        for x, y in _candidate_destinations(piece):
+            target = board.rubric(Position(x, y))
+            if target.piece_type != PieceType.PLACEHOLDER and target.color == piece.color:
+                continue
+            weight = 1.0
+            if target.piece_type != PieceType.PLACEHOLDER:
+                weight += capture_weight * CAPTURE_VALUES[target.piece_type]
+            # weighted random order (Efraimidis-Spirakis): the first valid move in this order is picked with a
+            # probability proportional to its weight among the valid moves
+            candidates.append((rnd.random() ** (1.0 / weight), piece,
+                               Move(Position(piece.position.x, piece.position.y), Position(x, y))))
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+    # Board.move_piece raises before touching the board whenever it rejects a move, so a single scratch copy
+    # can try the candidates one after the other
+    scratch = board.get_board_copy()
+    with quiet():  # Board prints while validating queen moves
+        for _, piece, move in candidates:
+            try:
+                # the piece's own pattern check is cheap, and spares move_piece a board copy when in Check
+                piece.is_valid_move(move, board.rubrics)
+                scratch.move_piece(move)
+            except Exception:
+                continue
+            return move
+    return None
+
+
+def generate_game(board_layout_filename: str, seed, game_number: int, max_plies: int = DEFAULT_MAX_PLIES,
+                  capture_weight: float = 0.0):
+    """plays a random game the way Game.run would. returns (moves, the result Game.run must reach)"""
+    rnd = random.Random('%s:%s' % (seed, game_number))
+    board = Board()
+    board.set_pieces(board_layout_filename)
+    moves = []
+
+    def picked_moves():
+        # picks each move on the board as play_moves left it, until the game runs out of plies or moves
+        while len(moves) < max_plies:
+            move = pick_move(board, rnd, capture_weight)
+            if move is None:
+                return
+            moves.append(move)
+            yield move
+
+    replay = play_moves(board, picked_moves())
+    while True:
+        try:
+            next(replay)
+        except StopIteration as stop:
+            return moves, stop.value
+
+
+def write_game(game_dir: str, board_layout_filename: str, moves):
+    """writes the game as a game directory, plus its compact moves file"""
+    os.makedirs(game_dir, exist_ok=True)
+    shutil.copyfile(board_layout_filename, os.path.join(game_dir, LAYOUT_FILENAME))
+    for moves_filename, player_moves in ((P1_MOVES_FILENAME, moves[0::2]), (P2_MOVES_FILENAME, moves[1::2])):
+        with open(os.path.join(game_dir, moves_filename), 'w') as moves_file:
+            for move in player_moves:
+                moves_file.write('%s,%s,%s,%s\n' % (move.from_pos.x, move.from_pos.y, move.to_pos.x, move.to_pos.y))
+    write_compact_moves(os.path.join(game_dir, COMPACT_MOVES_FILENAME), moves)
+
+
+def game_dir_name(game_number: int):
+    return 'game_%06d' % game_number
+
+
+def _generate_and_check(args):
+    """generates, writes and (optionally) replays a single game. returns (game number, disagreement or None)"""
+    output_dir, board_layout_filename, seed, game_number, max_plies, capture_weight, check = args
+    moves, expected = generate_game(board_layout_filename, seed, game_number, max_plies, capture_weight)
+    game_dir = os.path.join(output_dir, game_dir_name(game_number))
+    write_game(game_dir, board_layout_filename, moves)
+    if not check:
+        return game_number, None
+    actual = run_game(game_dir)
+    return game_number, None if actual == expected else {'expected': expected, 'actual': actual}
+
+
+def generate_games(output_dir: str, board_layout_filename: str, game_count: int, seed, processes: int = None,
+                   max_plies: int = DEFAULT_MAX_PLIES, capture_weight: float = 0.0, check: bool = True):
+    """generates the given number of games across processes. when check is set, every game is replayed through
+    Game.run. returns game directory name -> disagreement, for the games whose results differ"""
+    tasks = [(output_dir, board_layout_filename, seed, game_number, max_plies, capture_weight, check)
+             for game_number in range(game_count)]
+    disagreements = {}
+    with Pool(processes or os.cpu_count()) as pool:
+        for game_number, disagreement in pool.imap_unordered(_generate_and_check, tasks, chunksize=4):
+            if disagreement is not None:
+                disagreements[game_dir_name(game_number)] = disagreement
+    return disagreements
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='generate random games, checking them against Game.run')
+    parser.add_argument('output_dir', type=str)
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed', type=str, default='0')
+    parser.add_argument('--layout', type=str, default='initial_board_layout.json')
+    parser.add_argument('--max-plies', type=int, default=DEFAULT_MAX_PLIES)
+    parser.add_argument('--capture-weight', type=float, default=0.0,
+                        help='how much more likely captures are than quiet moves, per pawn of captured value')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--no-check', action='store_true', help="don't replay the games through Game.run")
+    args = parser.parse_args()
+
+    game_disagreements = generate_games(args.output_dir, args.layout, args.games, args.seed, args.processes,
+                                        args.max_plies, args.capture_weight, not args.no_check)
+    for game_name, game_disagreement in sorted(game_disagreements.items()):
+        print('%s: expected %s, Game.run reached %s' % (game_name, game_disagreement['expected'],
+                                                        game_disagreement['actual']))
+    print('generated %s games, %s disagreements' % (args.games, len(game_disagreements)))
@@ -16,7 +16,8 @@ class Player:
         self._moves_list = self.read_moves(open(filename, "r")) # note no attempt was made to make this code safe
         self._name = name
 
-    def read_moves(self, filecontents: str):
+    @staticmethod
+    def read_moves(filecontents: str):
         moves = []
         for line in filecontents:
             coords = list(map(int, line.split(',')))
@@ -0,0 +1,172 @@
+# an on-disk index of the positions reached by the games of a corpus.
+# the index answers "which games pass through this position" with a binary search over a memory-mapped file,
+# instead of replaying every game in the corpus through Board.move_piece.
+#
+# file layout (all integers are little endian):
+#   header:  magic (8 bytes), record count (u64), game count (u64)
+#   records: (position hash u64, game number u32, ply u32), sorted
+#   game ids: the corpus-relative game directories, utf-8, one per line. a record's game number is its line number
+import argparse
+import heapq
+import mmap
+import os
+import struct
+from board import Board
+from corpus import list_game_ids, replay_positions
+
+MAGIC = b'CHESSIDX'
+HEADER = struct.Struct('<8sQQ')
+RECORD = struct.Struct('<QII')
+
+
+class InvalidIndexFileException(Exception):
+    """thrown when a file is not a position index"""
+    pass
+
+
+class PositionIndex:
+    """read-only access to a position index file. the records are never loaded into memory"""
+
+    _file = None
+    _mmap = None
+    _record_count = None
+    _game_ids = None
+
+    def __init__(self, index_filename: str):
+        self._file = open(index_filename, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._record_count, game_count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise InvalidIndexFileException("%s is not a position index" % index_filename)
+        game_ids_offset = HEADER.size + self._record_count * RECORD.size
+        game_ids = self._mmap[game_ids_offset:].decode('utf-8')
+        self._game_ids = game_ids.split('\n') if game_count > 0 else []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def record_count(self):
+        return self._record_count
+
+    @property
+    def game_ids(self):
+        return self._game_ids
+
+    def record(self, i: int):
+        """returns the i-th (position hash, game number, ply) record"""
+        return RECORD.unpack_from(self._mmap, HEADER.size + i * RECORD.size)
+
+    def _first_record_not_below(self, position_hash: int):
+        """binary search for the first record whose hash is >= the given hash"""
+        lo, hi = 0, self._record_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.record(mid)[0] < position_hash:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, position):
+        """returns the list of (game id, ply) in which the given position (a Board or a position hash) is reached"""
+        position_hash = position.position_hash() if isinstance(position, Board) else position
+        matches = []
+        i = self._first_record_not_below(position_hash)
+        while i < self._record_count:
+            record_hash, game_number, ply = self.record(i)
+            if record_hash != position_hash:
+                break
+            matches.append((self._game_ids[game_number], ply))
+            i += 1
+        return matches
+
+    def iter_records(self):
+        """iterates over all the records in sorted order"""
+        records = memoryview(self._mmap)[HEADER.size:HEADER.size + self._record_count * RECORD.size]
+        try:
+            yield from RECORD.iter_unpack(records)
+        finally:
+            records.release()
+
+
+def index_game(game_dir: str, game_number: int):
+    """replays a single game and returns its (position hash, game number, ply) records"""
+    return [(board.position_hash(), game_number, ply) for ply, board in replay_positions(game_dir)]
+
+
+def write_index(index_filename: str, records, record_count: int, game_ids):
+    """writes the given sorted records and game ids into a new index file, replacing any existing one"""
+    temp_filename = index_filename + '.tmp'
+    with open(temp_filename, 'wb') as index_file:
+        index_file.write(HEADER.pack(MAGIC, record_count, len(game_ids)))
+        for record in records:
+            index_file.write(RECORD.pack(*record))
+        index_file.write('\n'.join(game_ids).encode('utf-8'))
+    # replacing the file is atomic, so readers see either the old index or the new one
+    os.replace(temp_filename, index_filename)
+
+
+def update_index(corpus_dir: str, index_filename: str):
+    """indexes the games of the corpus that are not in the index yet, creating the index if needed.
+    returns the number of newly indexed games"""
+    index = PositionIndex(index_filename) if os.path.exists(index_filename) else None
+    try:
+        known_game_ids = index.game_ids if index else []
+        known = set(known_game_ids)
+        new_game_ids = [game_id for game_id in list_game_ids(corpus_dir) if game_id not in known]
+        if index and not new_game_ids:
+            return 0
+
+        # only the new games are replayed and held in memory. the existing records are streamed out of the old file
+        new_records = []
+        for game_number, game_id in enumerate(new_game_ids, start=len(known_game_ids)):
+            new_records.extend(index_game(os.path.join(corpus_dir, game_id), game_number))
+        new_records.sort()
+
+        old_records = index.iter_records() if index else iter(())
+        record_count = (index.record_count if index else 0) + len(new_records)
+        write_index(index_filename, heapq.merge(old_records, new_records), record_count,
+                    known_game_ids + new_game_ids)
+        return len(new_game_ids)
+    finally:
+        if index:
+            index.close()
+
+
+def find_games(index_filename: str, board_layout_filename: str):
+    """returns the games in which the position given as a board layout file is reached (with white to move)"""
+    board = Board()
+    board.set_pieces(board_layout_filename)
+    with PositionIndex(index_filename) as index:
+        return index.lookup(board)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='index the positions reached by a corpus of games')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    update_parser = subparsers.add_parser('update', help='index new games of the corpus')
+    update_parser.add_argument('corpus_dir', type=str)
+    update_parser.add_argument('index_file', type=str)
+    find_parser = subparsers.add_parser('find', help='list the games that reach the given position')
+    find_parser.add_argument('index_file', type=str)
+    find_parser.add_argument('board_layout', type=str)
+    args = parser.parse_args()
+
+    if args.command == 'update':
+        print('indexed %s new games' % update_index(args.corpus_dir, args.index_file))
+    else:
+        for game_id, ply in find_games(args.index_file, args.board_layout):
+            print('%s ply %s' % (game_id, ply))
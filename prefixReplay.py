@@ -0,0 +1,135 @@
+# replays a corpus while sharing the work of common openings.
+# most recorded games start with the same few moves. instead of replaying every game from its initial layout, the
+# games that start from the same layout are merged into a trie of moves: every distinct prefix is validated once,
+# the board is copied only where games branch off, and each game then only replays its own tail.
+#
+# the results are the same as running every game through Game.run (see corpus.run_game), without the players'
+# threads: at every ply Check-mate is detected, then the next move is applied with corpus.play_ply, and the
+# checkmated side still has to play a valid move.
+import argparse
+import hashlib
+import os
+from board import Board
+from corpus import LAYOUT_FILENAME, list_game_ids, play_ply, quiet, read_game_moves, write_results
+from game import Game, NO_INPUT_FAILURE_REASON
+
+
+class _TrieNode:
+    """the position reached by a sequence of moves, shared by all the games starting with that sequence"""
+
+    def __init__(self):
+        self.children = {}  # (from x, from y, to x, to y) -> (Move, _TrieNode)
+        self.ending_games = []  # ids of the games whose moves end here
+        self.game_count = 0  # number of games going through this node
+
+    def games(self):
+        """returns the ids of all the games going through this node"""
+        game_ids, nodes = [], [self]
+        while nodes:
+            node = nodes.pop()
+            game_ids.extend(node.ending_games)
+            nodes.extend(child for _, child in node.children.values())
+        return game_ids
+
+
+class ReplayStats:
+    """counts how many plies were validated, against how many a game-by-game replay would validate"""
+
+    def __init__(self):
+        self.validated_plies = 0
+        self.naive_plies = 0
+
+    @property
+    def reused_plies(self):
+        return self.naive_plies - self.validated_plies
+
+    def __str__(self):
+        saved = 100.0 * self.reused_plies / self.naive_plies if self.naive_plies else 0.0
+        return 'validated %s plies instead of %s (%s reused, %.1f%% saved)' % (
+            self.validated_plies, self.naive_plies, self.reused_plies, saved)
+
+
+def _result(state: Game.State, plies: int, failure_reason: str = None):
+    return {'state': state.name, 'plies': plies, 'failure_reason': failure_reason}
+
+
+def build_tries(corpus_dir: str, game_ids):
+    """returns one move trie per distinct initial layout: layout filename -> root _TrieNode"""
+    tries = {}
+    layout_filenames = {}  # hash of the layout contents -> the first layout file with those contents
+    for game_id in game_ids:
+        game_dir = os.path.join(corpus_dir, game_id)
+        layout_filename = os.path.join(game_dir, LAYOUT_FILENAME)
+        with open(layout_filename, 'rb') as layout_file:
+            layout_hash = hashlib.sha256(layout_file.read()).hexdigest()
+        layout_filename = layout_filenames.setdefault(layout_hash, layout_filename)
+
+        node = tries.setdefault(layout_filename, _TrieNode())
+        node.game_count += 1
+        for move in read_game_moves(game_dir):
+            key = (move.from_pos.x, move.from_pos.y, move.to_pos.x, move.to_pos.y)
+            if key not in node.children:
+                node.children[key] = (move, _TrieNode())
+            node = node.children[key][1]
+            node.game_count += 1
+        node.ending_games.append(game_id)
+    return tries
+
+
+def replay_trie(layout_filename: str, root: _TrieNode, results: dict, stats: ReplayStats):
+    """replays all the games of a trie, filling results with game id -> result"""
+    board = Board()
+    board.set_pieces(layout_filename)
+    nodes = [(root, board, 0)]  # nodes to visit, with the board after their moves and their depth
+    while nodes:
+        node, board, depth = nodes.pop()
+        try:
+            checkmate = board.detect_checkmate()
+        except Exception as e:  # like in Game.run, anything that goes wrong borks the game
+            for game_id in node.games():
+                results[game_id] = _result(Game.State.BORKED, depth, str(e))
+            continue
+
+        # the games that end here ran out of moves
+        for game_id in node.ending_games:
+            results[game_id] = _result(Game.State.BORKED, depth, NO_INPUT_FAILURE_REASON)
+
+        # only branch points need copies of the board. the last child takes over this node's board
+        children = list(node.children.values())
+        for i, (move, child) in enumerate(children):
+            child_board = board if i == len(children) - 1 else board.get_board_copy()
+            stats.validated_plies += 1
+            stats.naive_plies += child.game_count
+            try:
+                winner = play_ply(child_board, move, checkmate)
+            except Exception as e:
+                for game_id in child.games():
+                    results[game_id] = _result(Game.State.BORKED, depth, str(e))
+                continue
+
+            if winner is not None:
+                for game_id in child.games():
+                    results[game_id] = _result(winner, depth + 1)
+                continue
+
+            nodes.append((child, child_board, depth + 1))
+
+
+def replay_corpus(corpus_dir: str):
+    """replays all the games of the corpus, sharing common prefixes. returns (game id -> result, ReplayStats)"""
+    results, stats = {}, ReplayStats()
+    tries = build_tries(corpus_dir, list_game_ids(corpus_dir))
+    with quiet():
+        for layout_filename, root in tries.items():
+            replay_trie(layout_filename, root, results, stats)
+    return results, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='replay a corpus of games, validating shared openings once')
+    parser.add_argument('corpus_dir', type=str)
+    parser.add_argument('output_file', type=str)
+    args = parser.parse_args()
+    corpus_results, replay_stats = replay_corpus(args.corpus_dir)
+    write_results(corpus_results, args.output_file)
+    print(replay_stats)
@@ -0,0 +1,131 @@
+# a persistent cache of game results, so unchanged games don't have to be validated again.
+# results are keyed by the contents of the game - its layout and both players' moves - and by the engine version,
+# which is a hash of the sources that decide a game's result. changing any of them changes the key, so stale
+# results are never returned; they are evicted once the cache grows past its size limit, least recently used first.
+#
+# the cache is an sqlite database, so several worker processes (see cluster.py) can share one cache file.
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from corpus import LAYOUT_FILENAME, P1_MOVES_FILENAME, P2_MOVES_FILENAME, list_game_ids, run_game, write_results
+
+DEFAULT_MAX_ENTRIES = 1000000
+BUSY_TIMEOUT_SECONDS = 30
+
+# the modules whose code decides the result of a game: corpus.run_game, which builds the cached result, and
+# everything it imports
+ENGINE_SOURCES = ['abstractPiece.py', 'board.py', 'concretePieces.py', 'corpus.py', 'evaluation.py', 'game.py',
+                  'player.py', 'tablebase.py', 'utils.py']
+
+
+def engine_version():
+    """returns a hash of the engine's sources"""
+    engine_hash = hashlib.sha256()
+    for source in ENGINE_SOURCES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), source), 'rb') as source_file:
+            engine_hash.update(source_file.read())
+    return engine_hash.hexdigest()
+
+
+def game_key(game_dir: str, version: str):
+    """returns the cache key of a game: a hash of its files' contents and the engine version"""
+    key_hash = hashlib.sha256(version.encode('ascii'))
+    for filename in (LAYOUT_FILENAME, P1_MOVES_FILENAME, P2_MOVES_FILENAME):
+        with open(os.path.join(game_dir, filename), 'rb') as game_file:
+            contents = game_file.read()
+        # the length keeps the boundaries between the files unambiguous
+        key_hash.update(len(contents).to_bytes(8, 'little'))
+        key_hash.update(contents)
+    return key_hash.hexdigest()
+
+
+class ResultCache:
+    """game results stored in an sqlite file, shared safely between processes"""
+
+    _connection = None
+    _max_entries = None
+    _version = None
+    hits = None
+    misses = None
+
+    def __init__(self, cache_filename: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self._connection = sqlite3.connect(cache_filename, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        # write-ahead logging lets readers go on while another process writes
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, state TEXT, '
+                                 'plies INTEGER, failure_reason TEXT, last_used REAL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+        self._max_entries = max_entries
+        self._version = engine_version()
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def get(self, key: str):
+        """returns the cached result for the given key, or None"""
+        row = self._connection.execute('SELECT state, plies, failure_reason FROM results WHERE key = ?',
+                                       (key,)).fetchone()
+        if row is None:
+            return None
+        self._connection.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        state, plies, failure_reason = row
+        return {'state': state, 'plies': plies, 'failure_reason': failure_reason}
+
+    def put(self, key: str, result: dict):
+        self._connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                                 (key, result['state'], result['plies'], result['failure_reason'], time.time()))
+
+    def evict(self):
+        """removes the least recently used results beyond the size limit. returns the number of removed results"""
+        cursor = self._connection.execute(
+            'DELETE FROM results WHERE key IN '
+            '(SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self._max_entries,))
+        return cursor.rowcount
+
+    def run_game(self, game_dir: str):
+        """returns the result of the given game, running it through Game.run only if it isn't cached"""
+        try:
+            key = game_key(game_dir, self._version)
+        except OSError:
+            return run_game(game_dir)  # unreadable game files are borked, theres nothing to cache
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = run_game(game_dir)
+        self.put(key, result)
+        return result
+
+
+def run_corpus(corpus_dir: str, cache_filename: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+    """runs all the games of the corpus through the cache. returns (game id -> result, hits, misses)"""
+    with ResultCache(cache_filename, max_entries) as cache:
+        results = {game_id: cache.run_game(os.path.join(corpus_dir, game_id))
+                   for game_id in list_game_ids(corpus_dir)}
+        cache.evict()
+        return results, cache.hits, cache.misses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='run a corpus of games, reusing the cached results')
+    parser.add_argument('corpus_dir', type=str)
+    parser.add_argument('cache_file', type=str)
+    parser.add_argument('output_file', type=str)
+    parser.add_argument('--max-entries', type=int, default=DEFAULT_MAX_ENTRIES)
+    args = parser.parse_args()
+    corpus_results, cache_hits, cache_misses = run_corpus(args.corpus_dir, args.cache_file, args.max_entries)
+    write_results(corpus_results, args.output_file)
+    print('%s games: %s cached, %s replayed' % (len(corpus_results), cache_hits, cache_misses))
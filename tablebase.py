@@ -0,0 +1,473 @@
+# endgame tablebases for small sets of pieces.
+# a table holds, for every placement of its pieces and side to move, whether the side to move wins, draws or loses
+# with best play, and the distance to mate in plies. tables are generated by retrograde analysis: starting from
+# the checkmates, positions are resolved backwards by un-moving pieces, level by level.
+#
+# the tables follow standard chess rules, not the simulator's: every piece type gives Check, a king never moves
+# into Check, pawns may move two rubrics from their starting rank and are crowned (to a queen, rook, bishop or horse)
+# on the last one. there is no castling or en passant. a result read from a table is therefore the result of the
+# ending under standard chess, and may differ from what Game.run reaches by playing the game out.
+#
+# a table is named after its material, white pieces first: 'KQK' is a white king and queen against a lone black
+# king, 'KBHK' a white king, bishop and horse against a lone king. the letters are the ones used for piece names:
+# K, Q, R, B, H (horse) and P.
+#
+# file layout: magic (8 bytes), signature (16 bytes, ascii, null padded), then one byte per position.
+# positions are indexed by (black to move, square of piece 1, ..., square of piece n), square = x * 8 + y.
+# a byte of 0 is a draw, 255 an illegal position, and anything else is the distance to mate + 1:
+# an odd distance means the side to move mates, an even distance means the side to move gets mated
+import argparse
+import mmap
+import os
+import struct
+from collections import defaultdict
+from enum import Enum
+from utils import DIAGONAL_DELTAS, HORSE_DELTAS, InternalErrorException, PieceColor, PieceType, STRAIGHT_DELTAS
+
+MAGIC = b'CHESSTB1'
+HEADER = struct.Struct('<8s16s')
+DRAW_VALUE = 0
+ILLEGAL_VALUE = 255
+
+# canonical order of the pieces within each side of a signature
+PIECE_ORDER = 'KQRBHP'
+PROMOTION_LETTERS = 'QRBH'
+PIECE_LETTERS = {PieceType.KING: 'K', PieceType.QUEEN: 'Q', PieceType.ROOK: 'R', PieceType.BISHOP: 'B',
+                 PieceType.HORSE: 'H', PieceType.PAWN: 'P'}
+
+
+class InvalidSignatureException(Exception):
+    """thrown when a material signature can't be turned into a table"""
+    pass
+
+
+class TablebaseResult(Enum):
+    """the outcome of a position with best play, for the side to move"""
+    WIN = 1
+    DRAW = 2
+    LOSS = 3
+
+
+def _x(square): return square // 8
+
+
+def _y(square): return square % 8
+
+
+def _steps(deltas):
+    """returns, for every square, the squares reachable by a single step of the given deltas"""
+    steps = []
+    for square in range(64):
+        x, y = _x(square), _y(square)
+        steps.append([(x + dx) * 8 + y + dy for dx, dy in deltas if 0 <= x + dx < 8 and 0 <= y + dy < 8])
+    return steps
+
+
+def _rays(directions):
+    """returns, for every square, one list of squares per direction, ordered away from the square"""
+    rays = []
+    for square in range(64):
+        square_rays = []
+        for dx, dy in directions:
+            ray = []
+            x, y = _x(square) + dx, _y(square) + dy
+            while 0 <= x < 8 and 0 <= y < 8:
+                ray.append(x * 8 + y)
+                x, y = x + dx, y + dy
+            square_rays.append(ray)
+        rays.append(square_rays)
+    return rays
+
+
+_KING_STEPS = _steps(STRAIGHT_DELTAS + DIAGONAL_DELTAS)
+_HORSE_STEPS = _steps(HORSE_DELTAS)
+_SLIDER_RAYS = {'Q': _rays(STRAIGHT_DELTAS + DIAGONAL_DELTAS), 'R': _rays(STRAIGHT_DELTAS),
+                'B': _rays(DIAGONAL_DELTAS)}
+
+
+def _pawn_step(square, white):
+    """returns the square in front of a pawn, or None on the last rank"""
+    y = _y(square) + (1 if white else -1)
+    return square + (1 if white else -1) if 0 <= y < 8 else None
+
+
+def _pawn_start_rank(white):
+    return 1 if white else 6
+
+
+def _pawn_last_rank(white):
+    """the rank on which a pawn is crowned"""
+    return 7 if white else 0
+
+
+def _pawn_attacks(square, white):
+    """returns the squares attacked by a pawn"""
+    y = _y(square) + (1 if white else -1)
+    if not 0 <= y < 8:
+        return []
+    return [x * 8 + y for x in (_x(square) - 1, _x(square) + 1) if 0 <= x < 8]
+
+
+def parse_signature(signature: str):
+    """splits a signature like 'KQK' into the white and black piece letters, in canonical order"""
+    second_king = signature.find('K', 1)
+    if not signature.startswith('K') or second_king < 0:
+        raise InvalidSignatureException("signature must list both kings, white first: %s" % signature)
+    white, black = signature[:second_king], signature[second_king:]
+    for side in (white, black):
+        if side.count('K') != 1 or any(letter not in PIECE_ORDER for letter in side):
+            raise InvalidSignatureException("invalid pieces in signature %s" % signature)
+    return sorted(white, key=PIECE_ORDER.index), sorted(black, key=PIECE_ORDER.index)
+
+
+class _Material:
+    """the pieces of a table and the move generation over their placements"""
+
+    def __init__(self, signature: str):
+        white, black = parse_signature(signature)
+        self.signature = ''.join(white + black)
+        self.letters = white + black
+        self.whites = [True] * len(white) + [False] * len(black)
+        self.count = len(self.letters)
+        self.size = 2 * 64 ** self.count
+        self.kings = {True: 0, False: len(white)}
+
+    def encode(self, squares, white_to_move):
+        index = 0 if white_to_move else 1
+        for square in squares:
+            index = index * 64 + square
+        return index
+
+    def decode(self, index):
+        squares = [0] * self.count
+        for i in range(self.count - 1, -1, -1):
+            index, squares[i] = divmod(index, 64)
+        return squares, index == 0
+
+    def is_attacked(self, squares, occupied, target, by_white):
+        """returns True if a piece of the given color attacks the target square"""
+        for i in range(self.count):
+            if self.whites[i] != by_white or squares[i] < 0:
+                continue
+            letter, square = self.letters[i], squares[i]
+            if letter == 'K':
+                if target in _KING_STEPS[square]:
+                    return True
+            elif letter == 'H':
+                if target in _HORSE_STEPS[square]:
+                    return True
+            elif letter == 'P':
+                if target in _pawn_attacks(square, by_white):
+                    return True
+            else:
+                for ray in _SLIDER_RAYS[letter][square]:
+                    for ray_square in ray:
+                        if ray_square == target:
+                            return True
+                        if ray_square in occupied:
+                            break
+        return False
+
+    def in_check(self, squares, occupied, white):
+        """returns True if the king of the given color is attacked"""
+        return self.is_attacked(squares, occupied, squares[self.kings[white]], not white)
+
+    def targets(self, i, squares, occupied):
+        """returns the squares piece i can move to, ignoring Check-semantics"""
+        letter, square, white = self.letters[i], squares[i], self.whites[i]
+        if letter == 'K' or letter == 'H':
+            steps = _KING_STEPS if letter == 'K' else _HORSE_STEPS
+            return [target for target in steps[square]
+                    if target not in occupied or self.whites[occupied[target]] != white]
+        if letter == 'P':
+            targets = [target for target in _pawn_attacks(square, white)
+                       if target in occupied and self.whites[occupied[target]] != white]
+            step = _pawn_step(square, white)
+            if step is not None and step not in occupied:
+                targets.append(step)
+                double_step = _pawn_step(step, white)
+                if _y(square) == _pawn_start_rank(white) and double_step not in occupied:
+                    targets.append(double_step)
+            return targets
+        targets = []
+        for ray in _SLIDER_RAYS[letter][square]:
+            for target in ray:
+                if target in occupied:
+                    if self.whites[occupied[target]] != white:
+                        targets.append(target)
+                    break
+                targets.append(target)
+        return targets
+
+    def origins(self, i, squares, occupied):
+        """returns the squares piece i could have come from without capturing (the reverse of targets)"""
+        letter, square, white = self.letters[i], squares[i], self.whites[i]
+        if letter == 'K' or letter == 'H':
+            steps = _KING_STEPS if letter == 'K' else _HORSE_STEPS
+            return [origin for origin in steps[square] if origin not in occupied]
+        if letter == 'P':
+            origins = []
+            origin = _pawn_step(square, not white)
+            # pawns never stand on their first rank
+            if origin is not None and origin not in occupied and _y(origin) != _pawn_last_rank(not white):
+                origins.append(origin)
+                double_origin = _pawn_step(origin, not white)
+                if _y(double_origin) == _pawn_start_rank(white) and double_origin not in occupied:
+                    origins.append(double_origin)
+            return origins
+        origins = []
+        for ray in _SLIDER_RAYS[letter][square]:
+            for origin in ray:
+                if origin in occupied:
+                    break
+                origins.append(origin)
+        return origins
+
+    def is_promotion(self, i, target):
+        """returns True if moving piece i to the target square crowns it"""
+        return self.letters[i] == 'P' and _y(target) == _pawn_last_rank(self.whites[i])
+
+    def exit_position(self, squares, captured=None, promoted=None):
+        """returns the signature of the table reached when a capture and/or a crowning leaves this one, and the
+        squares of the pieces in that signature's order. promoted is (piece index, letter of the new piece)"""
+        pieces = []
+        for i, square in enumerate(squares):
+            if i == captured:
+                continue
+            letter = promoted[1] if promoted is not None and promoted[0] == i else self.letters[i]
+            pieces.append((not self.whites[i], PIECE_ORDER.index(letter), letter, square))
+        pieces.sort()
+        return ''.join(piece[2] for piece in pieces), [piece[3] for piece in pieces]
+
+    def exit_signatures(self):
+        """returns the signatures of all the tables reachable by captures and crownings"""
+        squares = list(range(self.count))
+        captures = [None] + [i for i in range(self.count) if self.letters[i] != 'K']
+        promotions = [None] + [(i, letter) for i in range(self.count) if self.letters[i] == 'P'
+                               for letter in PROMOTION_LETTERS]
+        return {self.exit_position(squares, captured, promoted)[0] for captured in captures
+                for promoted in promotions
+                if (captured is not None or promoted is not None)
+                and (promoted is None or captured is None or self.whites[captured] != self.whites[promoted[0]])}
+
+
+def table_filename(tablebase_dir: str, signature: str):
+    return os.path.join(tablebase_dir, '%s.tb' % signature)
+
+
+def generate(signature: str, tablebase_dir: str):
+    """generates the table for the given material (and the tables for the material left after captures)
+    unless it already exists. returns the table's filename"""
+    material = _Material(signature)
+    filename = table_filename(tablebase_dir, material.signature)
+    if os.path.exists(filename):
+        return filename
+
+    # captures and crownings leave this table. the values after them come from the tables they lead to
+    subtables = {}
+    for sub_signature in material.exit_signatures():
+        subtables[sub_signature] = Tablebase(generate(sub_signature, tablebase_dir))
+
+    try:
+        values = _retrograde_analysis(material, subtables)
+    finally:
+        for subtable in subtables.values():
+            subtable.close()
+
+    os.makedirs(tablebase_dir, exist_ok=True)
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as table_file:
+        table_file.write(HEADER.pack(MAGIC, material.signature.encode('ascii')))
+        table_file.write(values)
+    os.replace(temp_filename, filename)
+    return filename
+
+
+def _retrograde_analysis(material: _Material, subtables):
+    """computes the value byte of every position of the table"""
+    values = bytearray(material.size)
+    remaining_moves = bytearray(material.size)  # moves within the table that were not refuted yet
+    loss_floor = bytearray(material.size)  # the distance to mate if all the moves turn out to lose
+    cannot_lose = bytearray(material.size)  # some move reaches a draw or a win
+    pending = defaultdict(list)  # distance to mate -> positions to resolve at that distance, with their result
+
+    # first pass: mark illegal positions, find the checkmates and resolve the moves out of the table
+    pawns = [i for i in range(material.count) if material.letters[i] == 'P']
+    for index in range(material.size):
+        squares, white_to_move = material.decode(index)
+        occupied = {square: i for i, square in enumerate(squares)}
+        if len(occupied) < material.count or material.in_check(squares, occupied, not white_to_move) \
+                or any(_y(squares[i]) in (0, 7) for i in pawns):
+            values[index] = ILLEGAL_VALUE
+            continue
+
+        moves, best_exit = 0, None
+        for i in range(material.count):
+            if material.whites[i] != white_to_move:
+                continue
+            for target in material.targets(i, squares, occupied):
+                captured = occupied.get(target)
+                after = list(squares)
+                after[i] = target
+                if captured is not None:
+                    after[captured] = -1
+                after_occupied = {square: j for j, square in enumerate(after) if square >= 0}
+                if material.in_check(after, after_occupied, white_to_move):
+                    continue
+                # a crowning pawn may become any of the promotion pieces, each of them is a move of its own
+                promotions = [(i, letter) for letter in PROMOTION_LETTERS] if material.is_promotion(i, target) \
+                    else [None]
+                for promoted in promotions:
+                    moves += 1
+                    if captured is None and promoted is None:
+                        remaining_moves[index] += 1
+                        continue
+
+                    sub_signature, sub_squares = material.exit_position(after, captured, promoted)
+                    result, distance = subtables[sub_signature].probe(sub_squares, not white_to_move)
+                    if result == TablebaseResult.LOSS:
+                        best_exit = distance + 1 if best_exit is None else min(best_exit, distance + 1)
+                    elif result == TablebaseResult.WIN:
+                        loss_floor[index] = max(loss_floor[index], distance + 1)
+                    else:
+                        cannot_lose[index] = 1
+
+        if moves == 0:
+            if material.in_check(squares, occupied, white_to_move):
+                pending[0].append((index, TablebaseResult.LOSS))
+            # otherwise its a stalemate, and stays a draw
+        elif best_exit is not None:
+            cannot_lose[index] = 1
+            pending[best_exit].append((index, TablebaseResult.WIN))
+        elif remaining_moves[index] == 0 and not cannot_lose[index]:
+            pending[loss_floor[index]].append((index, TablebaseResult.LOSS))
+
+    # resolve positions in increasing distance to mate. a position whose opponent gets mated in d plies after
+    # some move wins in d + 1; a position whose every move lets the opponent mate loses in the longest of those
+    while pending:
+        distance = min(pending)
+        if distance + 1 >= ILLEGAL_VALUE:
+            raise InternalErrorException("distance to mate too long for table %s" % material.signature)
+        for index, result in pending.pop(distance):
+            if values[index] != DRAW_VALUE:
+                continue  # already resolved at a shorter distance
+            values[index] = distance + 1
+
+            squares, white_to_move = material.decode(index)
+            occupied = {square: i for i, square in enumerate(squares)}
+            for previous in _previous_positions(material, squares, occupied, white_to_move):
+                if values[previous] != DRAW_VALUE:
+                    continue
+                if result == TablebaseResult.LOSS:
+                    pending[distance + 1].append((previous, TablebaseResult.WIN))
+                else:
+                    remaining_moves[previous] -= 1
+                    loss_floor[previous] = max(loss_floor[previous], distance + 1)
+                    if remaining_moves[previous] == 0 and not cannot_lose[previous]:
+                        pending[loss_floor[previous]].append((previous, TablebaseResult.LOSS))
+    return values
+
+
+def _previous_positions(material: _Material, squares, occupied, white_to_move):
+    """returns the indices of the legal positions from which a move that stays within the table (no capture, no
+    crowning) leads to the given position"""
+    mover = not white_to_move
+    previous_positions = []
+    for i in range(material.count):
+        if material.whites[i] != mover:
+            continue
+        for origin in material.origins(i, squares, occupied):
+            before = list(squares)
+            before[i] = origin
+            before_occupied = dict(occupied)
+            del before_occupied[squares[i]]
+            before_occupied[origin] = i
+            # the side that did not move must not have been left in check
+            if not material.in_check(before, before_occupied, white_to_move):
+                previous_positions.append(material.encode(before, mover))
+    return previous_positions
+
+
+class Tablebase:
+    """read access to a generated table. the table is memory-mapped, never loaded"""
+
+    _file = None
+    _mmap = None
+    _material = None
+
+    def __init__(self, filename: str):
+        self._file = open(filename, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, signature = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            self.close()
+            raise InvalidSignatureException("%s is not a tablebase" % filename)
+        self._material = _Material(signature.rstrip(b'\0').decode('ascii'))
+        if len(self._mmap) != HEADER.size + self._material.size:
+            self.close()
+            raise InternalErrorException("tablebase %s is truncated" % filename)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def signature(self):
+        return self._material.signature
+
+    def probe(self, squares, white_to_move: bool):
+        """returns (result, distance to mate in plies) for the pieces on the given squares, in signature order.
+        the distance is None for draws. returns None for positions that can't be reached legally"""
+        value = self._mmap[HEADER.size + self._material.encode(squares, white_to_move)]
+        if value == ILLEGAL_VALUE:
+            return None
+        if value == DRAW_VALUE:
+            return TablebaseResult.DRAW, None
+        distance = value - 1
+        return (TablebaseResult.WIN if distance % 2 == 1 else TablebaseResult.LOSS), distance
+
+
+_open_tables = {}  # filename -> Tablebase, so probing doesn't reopen the file on every position
+
+
+def _open_table(tablebase_dir: str, signature: str):
+    filename = table_filename(tablebase_dir, signature)
+    if filename not in _open_tables:
+        if not os.path.exists(filename):
+            return None
+        _open_tables[filename] = Tablebase(filename)
+    return _open_tables[filename]
+
+
+def probe(tablebase_dir: str, pieces, side_to_move: PieceColor):
+    """returns (result, distance to mate in plies) for the side to move, or None if there's no table for the
+    given material (or the position is illegal). pieces is a list of (piece type, color, x, y)"""
+    def side(color, flip):
+        side_pieces = sorted((piece for piece in pieces if piece[1] == color),
+                             key=lambda piece: PIECE_ORDER.index(PIECE_LETTERS[piece[0]]))
+        letters = ''.join(PIECE_LETTERS[piece[0]] for piece in side_pieces)
+        # flipping the colors mirrors the board, so pawns keep moving towards the other side
+        squares = [x * 8 + (7 - y if flip else y) for _, _, x, y in side_pieces]
+        return letters, squares
+
+    for flip in (False, True):
+        first, second = (PieceColor.BLACK, PieceColor.WHITE) if flip else (PieceColor.WHITE, PieceColor.BLACK)
+        first_letters, first_squares = side(first, flip)
+        second_letters, second_squares = side(second, flip)
+        table = _open_table(tablebase_dir, first_letters + second_letters)
+        if table is not None:
+            return table.probe(first_squares + second_squares, side_to_move == first)
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='generate endgame tablebases')
+    parser.add_argument('tablebase_dir', type=str)
+    parser.add_argument('signatures', type=str, nargs='+', help="material signatures, like KQK or KBHK")
+    args = parser.parse_args()
+    for signature in args.signatures:
+        print('generated %s' % generate(signature, args.tablebase_dir))
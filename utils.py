@@ -30,6 +30,13 @@ class PieceColor(Enum):
     BLACK = 2
 
 
+# the (dx, dy) steps of the pieces' movement patterns, regardless of what's on the board
+STRAIGHT_DELTAS = [(1, 0), (-1, 0), (0, 1), (0, -1)]  # rook directions
+DIAGONAL_DELTAS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]  # bishop directions
+KING_DELTAS = [(1, 0), (-1, 0), (0, -1), (0, 1), (1, 1), (-1, 1), (1, -1), (-1, -1)]
+HORSE_DELTAS = [(1, 2), (2, 1), (-1, 2), (-2, 1), (1, -2), (2, -1), (-1, -2), (-2, -1)]
+
+
 class Position:
     """represents a valid position on the board"""
 
@@ -93,13 +100,20 @@ class ThreadWithReturnValue(Thread):
     def __init__(self, group=None, target=None, name=None, args=(), kwargs=None, *, daemon=None):
         Thread.__init__(self, group, target, name, args, kwargs, daemon=daemon)
         self._return = None
+        self._exception = None
 
     def run(self):
         if self._target is not None:
-            self._return = self._target(*self._args, **self._kwargs)
+            try:
+                self._return = self._target(*self._args, **self._kwargs)
+            except Exception as e:  # handed over to the joining thread
+                self._exception = e
 
     def join(self, timeout):
+        """returns the called function's value, or raises the exception it raised"""
         Thread.join(self, timeout=timeout)
+        if self._exception is not None:
+            raise self._exception
         return self._return
 
 